@@ -0,0 +1,200 @@
+from typing import Callable, List, Optional
+
+import numpy as np
+import pytorch_lightning as pl
+import torch
+from nvidia.dali import fn, pipeline_def, types
+from nvidia.dali.plugin.pytorch import DALIGenericIterator
+
+from data.acdc_dataset import ACDCDatasetUnlabeleld
+from data.acdc_utils import list_acdc_volumes
+
+
+class ACDCExternalSource:
+    def __init__(self, dataset: ACDCDatasetUnlabeleld, batch_size: int, shard_id: int = 0,
+                 num_shards: int = 1, seed: int = 12):
+        """Feeds ACDC slices from the in-memory volume cache of the dataset to a DALI pipeline.
+        The samples are shuffled with the same permutation on every shard, and each shard reads
+        an equally sized, disjoint part of it, yielding full batches only.
+
+        Args:
+            dataset (ACDCDatasetUnlabeleld): dataset to read the slices from (without transforms).
+            batch_size (int): batch size per shard.
+            shard_id (int, optional): id of the current shard. Defaults to 0.
+            num_shards (int, optional): total number of shards. Defaults to 1.
+            seed (int, optional): seed for shuffling, incremented every epoch. Defaults to 12.
+        """
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shard_id = shard_id
+        self.shard_size = len(dataset) // num_shards
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self) -> int:
+        return self.shard_size // self.batch_size
+
+    def __iter__(self):
+        permutation = np.random.default_rng(self.seed + self.epoch).permutation(len(self.dataset))
+        self.indexes = permutation[self.shard_id * self.shard_size:(self.shard_id + 1) * self.shard_size]
+        self.position = 0
+        self.epoch += 1
+        return self
+
+    def __next__(self):
+        if self.position + self.batch_size > len(self.indexes):
+            raise StopIteration
+        images, indexes = [], []
+        for index in self.indexes[self.position:self.position + self.batch_size]:
+            file_id, slice_id, _, _ = self.dataset.samples[index]
+            sample = self.dataset.img_cache[file_id][..., slice_id]
+            # Same uint8 conversion as in ACDCDatasetUnlabeleld, as HWC grayscale images
+            images.append(np.ascontiguousarray(sample.astype(np.uint8)[..., None]))
+            indexes.append(np.array([index], dtype=np.int64))
+        self.position += self.batch_size
+        return images, indexes
+
+
+def build_transform_pipeline_dali(aug_cfg) -> Callable:
+    """DALI counterpart of solo-learn's build_transform_pipeline for single channel ACDC slices.
+    Saturation, hue and grayscale conversion are no-ops for grayscale images, therefore only
+    random resized crop, brightness/contrast jitter, horizontal flip and normalization are applied.
+    The augmentations run on the device of their input, which is selected by acdc_pretrain_pipeline.
+    Gaussian blur, solarization and equalization are not supported, main_pretrain falls back to the
+    PyTorch dataloader for augmentation configs using them.
+    As in torchvision's ColorJitter, contrast is scaled around the mean of each image instead of DALI's
+    default (half of the uint8 range), the mean of the whole slice is used as it has to be computed on the CPU.
+
+    Args:
+        aug_cfg (DictConfig): a single augmentation config, e.g. an item of configs/augmentations/acdc.yaml
+
+    Returns:
+        Callable: applies the augmentations on a (DALI images, per-sample means) tuple,
+            returns normalized CHW crops.
+    """
+    for unsupported in ["gaussian_blur", "solarization", "equalization"]:
+        assert aug_cfg[unsupported].prob == 0.0, f"{unsupported} is not supported by the ACDC DALI pipeline"
+
+    crop_size = aug_cfg.crop_size
+    # Same normalization as in the torchvision pipeline: (x / 255 - mean) / std
+    mean = [v * 255 for v in np.atleast_1d(aug_cfg.mean).tolist()]
+    std = [v * 255 for v in np.atleast_1d(aug_cfg.std).tolist()]
+
+    def augment(sample):
+        images, means = sample
+        if aug_cfg.rrc.enabled:
+            images = fn.random_resized_crop(
+                images,
+                size=[crop_size, crop_size],
+                random_area=[aug_cfg.rrc.crop_min_scale, aug_cfg.rrc.crop_max_scale],
+                interp_type=types.INTERP_CUBIC,
+            )
+        else:
+            images = fn.resize(images, resize_x=crop_size, resize_y=crop_size,
+                               interp_type=types.INTERP_CUBIC)
+
+        if aug_cfg.color_jitter.prob:
+            # Factors fall back to 1.0 (identity) when the jitter is not applied
+            apply = fn.random.coin_flip(probability=aug_cfg.color_jitter.prob, dtype=types.FLOAT)
+            brightness, contrast = aug_cfg.color_jitter.brightness, aug_cfg.color_jitter.contrast
+            brightness = fn.random.uniform(range=[max(0.0, 1 - brightness), 1 + brightness])
+            contrast = fn.random.uniform(range=[max(0.0, 1 - contrast), 1 + contrast])
+            images = fn.brightness_contrast(images,
+                                            brightness=1.0 + apply * (brightness - 1.0),
+                                            contrast=1.0 + apply * (contrast - 1.0),
+                                            contrast_center=means)
+
+        mirror = fn.random.coin_flip(probability=aug_cfg.horizontal_flip.prob)
+        return fn.crop_mirror_normalize(images, dtype=types.FLOAT, output_layout="CHW",
+                                        mean=mean, std=std, mirror=mirror)
+
+    return augment
+
+
+@pipeline_def
+def acdc_pretrain_pipeline(source: ACDCExternalSource, transforms: Callable, dali_device: str = "gpu"):
+    images, indexes = fn.external_source(source=source, num_outputs=2, cycle="raise",
+                                         dtype=[types.UINT8, types.INT64], layout=["HWC", ""])
+    # Contrast centers are argument inputs, which have to stay on the CPU
+    means = fn.reductions.mean(images, dtype=types.FLOAT)
+    if dali_device == "gpu":
+        images = images.gpu()
+        indexes = indexes.gpu()
+    crops = transforms((images, means))
+    return (*crops, indexes)
+
+
+class ACDCPretrainWrapper(DALIGenericIterator):
+    def __init__(self, num_crops: int, length: int, *args, **kwargs):
+        """Converts the outputs of the DALI pipeline to the [indexes, crops, targets] batches
+        expected by solo-learn's methods.
+        """
+        super().__init__(*args, **kwargs)
+        self.num_crops = num_crops
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __next__(self):
+        batch = super().__next__()[0]
+        indexes = batch["index"].squeeze(-1).long()
+        crops = [batch[f"crop{i}"] for i in range(self.num_crops)]
+        # ACDCDatasetUnlabeleld returns 0 as a target for every sample
+        targets = torch.zeros_like(indexes)
+        return [indexes, crops, targets]
+
+
+class ACDCPretrainDALIDataModule(pl.LightningDataModule):
+    def __init__(self, train_data_path: str, transforms: Callable, num_crops: int, num_workers: int = 4,
+                 batch_size: int = 16, dali_device: str = "gpu", seed: int = 12):
+        """DataModule that decodes the ACDC volumes once on the CPU, and executes the augmentations
+        of the pretraining with DALI (on the GPU by default).
+
+        Args:
+            train_data_path (str): path to the ACDC training folder.
+            transforms (Callable): DALI transform pipeline returning a list of crops,
+                e.g. FullTransformPipeline of build_transform_pipeline_dali.
+            num_crops (int): total number of crops returned by the transforms.
+            num_workers (int, optional): number of DALI CPU threads. Defaults to 4.
+            batch_size (int, optional): batch size per GPU. Defaults to 16.
+            dali_device (str, optional): "gpu" or "cpu". Defaults to "gpu".
+            seed (int, optional): seed of the pipeline and shuffling. Defaults to 12.
+        """
+        super().__init__()
+        self.train_data_path = train_data_path
+        self.transforms = transforms
+        self.num_crops = num_crops
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.dali_device = dali_device
+        self.seed = seed
+
+    def setup(self, stage: Optional[str] = None):
+        self.device_id = self.trainer.local_rank
+        self.shard_id = self.trainer.global_rank
+        self.num_shards = self.trainer.world_size
+
+        # Only rank 0 scans the dataset folder
+        file_list = None
+        if self.trainer.is_global_zero:
+            file_list = list_acdc_volumes(self.train_data_path, include_unlabelled=True)
+        file_list = self.trainer.strategy.broadcast(file_list, src=0)
+        self.train_dataset = ACDCDatasetUnlabeleld(root=self.train_data_path, file_list=file_list)
+
+    def train_dataloader(self):
+        source = ACDCExternalSource(self.train_dataset, self.batch_size, shard_id=self.shard_id,
+                                    num_shards=self.num_shards, seed=self.seed)
+        pipeline = acdc_pretrain_pipeline(
+            source=source,
+            transforms=self.transforms,
+            dali_device=self.dali_device,
+            batch_size=self.batch_size,
+            num_threads=self.num_workers,
+            device_id=self.device_id if self.dali_device == "gpu" else None,
+            seed=self.seed + self.shard_id,
+        )
+        pipeline.build()
+        output_map: List[str] = [f"crop{i}" for i in range(self.num_crops)] + ["index"]
+        return ACDCPretrainWrapper(self.num_crops, len(source), pipelines=pipeline,
+                                   output_map=output_map, auto_reset=True)
@@ -85,14 +85,23 @@ class ACDCDatasetUnlabeleld(Dataset):
     all_samples = None
     img_cache = None
 
-    def __init__(self, root, transform=None, split='train') -> None:
+    def __init__(self, root, transform=None, split='train', file_list=None) -> None:
+        """
+        Args:
+            root (str): dataset root folder
+            transform (callable): transform applied to the slices
+            split (str): 'train', 'val' or 'test'
+            file_list (list of str): precomputed list_acdc_volumes(root, include_unlabelled=True),
+                                     e.g. broadcasted from rank 0 to avoid scanning root on every rank
+        """
         super().__init__()
         self.root = root
         self.transform = transform
         self.split = split
 
         if self.all_samples is None:
-            all_samples, img_cache, _  = construct_samples_list(self.root, include_unlabelled=True)
+            all_samples, img_cache, _  = construct_samples_list(self.root, include_unlabelled=True,
+                                                                nii_gz_paths=file_list)
             ACDCDatasetUnlabeleld.all_samples = all_samples
             ACDCDatasetUnlabeleld.img_cache = img_cache
         
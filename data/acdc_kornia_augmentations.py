@@ -0,0 +1,95 @@
+from typing import Callable, List, Sequence, Tuple
+
+import kornia.augmentation as K
+import numpy as np
+import torch
+import torchvision.transforms as T
+
+
+class ResizeToTensor:
+    def __init__(self, size: int):
+        """CPU part of the GPU augmentation pipeline: converts ACDC slices to uint8 tensors
+        of a common size, so they can be batched and transferred to the GPU.
+
+        Args:
+            size (int): height and width of the resized slices, should be the largest crop size.
+        """
+        self.resize = T.Resize((size, size), interpolation=T.InterpolationMode.BICUBIC)
+
+    def __call__(self, x: np.ndarray) -> torch.Tensor:
+        # Same uint8 conversion as in ACDCDatasetUnlabeleld, as 1xHxW tensors
+        return self.resize(torch.from_numpy(x.astype(np.uint8))[None])
+
+    def __repr__(self) -> str:
+        return str(self.resize)
+
+
+def build_transform_pipeline_kornia(aug_cfg) -> K.AugmentationSequential:
+    """Kornia counterpart of solo-learn's build_transform_pipeline for single channel ACDC slices.
+    Saturation, hue and grayscale conversion are no-ops for grayscale images, therefore they are not applied.
+
+    Args:
+        aug_cfg (DictConfig): a single augmentation config, e.g. an item of configs/augmentations/acdc.yaml
+
+    Returns:
+        K.AugmentationSequential: augments a batch of float images in the [0, 1] range.
+    """
+    crop_size = (aug_cfg.crop_size, aug_cfg.crop_size)
+    augmentations = []
+    if aug_cfg.rrc.enabled:
+        augmentations.append(
+            K.RandomResizedCrop(crop_size, scale=(aug_cfg.rrc.crop_min_scale, aug_cfg.rrc.crop_max_scale),
+                                resample="BICUBIC")
+        )
+    else:
+        augmentations.append(K.Resize(crop_size, resample="BICUBIC"))
+
+    if aug_cfg.color_jitter.prob:
+        augmentations.append(
+            K.ColorJitter(brightness=aug_cfg.color_jitter.brightness, contrast=aug_cfg.color_jitter.contrast,
+                          p=aug_cfg.color_jitter.prob)
+        )
+    if aug_cfg.gaussian_blur.prob:
+        augmentations.append(K.RandomGaussianBlur((23, 23), (0.1, 2.0), p=aug_cfg.gaussian_blur.prob))
+    if aug_cfg.solarization.prob:
+        # Fixed 0.5 threshold, as PIL's solarize
+        augmentations.append(K.RandomSolarize(thresholds=0.0, additions=0.0, p=aug_cfg.solarization.prob))
+    if aug_cfg.equalization.prob:
+        augmentations.append(K.RandomEqualize(p=aug_cfg.equalization.prob))
+    if aug_cfg.horizontal_flip.prob:
+        augmentations.append(K.RandomHorizontalFlip(p=aug_cfg.horizontal_flip.prob))
+
+    augmentations.append(
+        K.Normalize(mean=torch.tensor(np.atleast_1d(aug_cfg.mean), dtype=torch.float32),
+                    std=torch.tensor(np.atleast_1d(aug_cfg.std), dtype=torch.float32))
+    )
+    return K.AugmentationSequential(*augmentations)
+
+
+class GPUTransformPipeline:
+    def __init__(self, pipelines: Sequence[Tuple[Callable, int]]):
+        """GPU counterpart of solo-learn's FullTransformPipeline of NCropAugmentations.
+
+        Args:
+            pipelines (Sequence[Tuple[Callable, int]]): (batched augmentation, number of crops) pairs.
+        """
+        self.pipelines = pipelines
+
+    @torch.no_grad()
+    def __call__(self, images: torch.Tensor) -> List[torch.Tensor]:
+        """
+        Args:
+            images (torch.Tensor): batch of uint8 images, (B, C, H, W)
+
+        Returns:
+            List[torch.Tensor]: list of augmented crops, each (B, C, crop_size, crop_size)
+        """
+        images = images.float() / 255
+        crops = []
+        for transform, num_crops in self.pipelines:
+            # The crops of a pipeline are augmented in a single batched call
+            crops.extend(transform(images.repeat(num_crops, 1, 1, 1)).chunk(num_crops))
+        return crops
+
+    def __repr__(self) -> str:
+        return "\n".join(f"{num_crops} x {transform}" for transform, num_crops in self.pipelines)
@@ -0,0 +1,50 @@
+from typing import Callable, Optional
+
+import pytorch_lightning as pl
+from solo.data.pretrain_dataloader import dataset_with_index
+
+from data.acdc_dataset import ACDCDatasetUnlabeleld
+from data.acdc_utils import list_acdc_volumes
+from self_supervised.pretrain_dataloader import prepare_pretrain_dataloader
+
+
+class ACDCPretrainDataModule(pl.LightningDataModule):
+    def __init__(self, train_data_path: str, transform: Callable, batch_size: int = 64, num_workers: int = 4,
+                 gpu_transform: Optional[Callable] = None):
+        """DataModule for pretraining on the (unlabelled) ACDC dataset.
+        The dataset is built in setup, after the processes are initialized: rank 0 scans the dataset
+        folder and broadcasts the file list, instead of every rank scanning the same folder.
+
+        Args:
+            train_data_path (str): path to the ACDC training folder.
+            transform (Callable): transform returning the crops of a sample, e.g. FullTransformPipeline.
+            batch_size (int, optional): batch size per GPU. Defaults to 64.
+            num_workers (int, optional): number of dataloader workers. Defaults to 4.
+            gpu_transform (Optional[Callable], optional): transform applied on the training batches after they
+                are transferred to the GPU, e.g. GPUTransformPipeline. Defaults to None.
+        """
+        super().__init__()
+        self.train_data_path = train_data_path
+        self.transform = transform
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.gpu_transform = gpu_transform
+
+    def setup(self, stage: Optional[str] = None):
+        file_list = None
+        if self.trainer.is_global_zero:
+            file_list = list_acdc_volumes(self.train_data_path, include_unlabelled=True)
+        file_list = self.trainer.strategy.broadcast(file_list, src=0)
+        self.train_dataset = dataset_with_index(ACDCDatasetUnlabeleld)(
+            root=self.train_data_path, transform=self.transform, file_list=file_list
+        )
+
+    def train_dataloader(self):
+        return prepare_pretrain_dataloader(self.train_dataset, batch_size=self.batch_size,
+                                           num_workers=self.num_workers)
+
+    def on_after_batch_transfer(self, batch, dataloader_idx: int):
+        if self.gpu_transform is not None and self.trainer.training:
+            indexes, images, targets = batch
+            batch = [indexes, self.gpu_transform(images), targets]
+        return batch
@@ -44,7 +44,23 @@ def load_acdc_img(path, dtype=np.uint16):
     return img
 
 
-def construct_samples_list(root, include_unlabelled=False):
+def list_acdc_volumes(root, include_unlabelled=False):
+    """
+    Args:
+        root (str): dataset root folder
+        include_unlabelled (bool): include the unlabelled 4d volumes as well
+
+    Returns:
+        list of str: sorted paths of the image volumes (ground truth volumes are excluded)
+    """
+    nii_gz_paths = sorted(glob.glob(os.path.join(root,'**', '*.nii.gz'), recursive=True))
+    nii_gz_paths = [path_ for path_ in nii_gz_paths if '_gt.nii' not in path_ ]
+    if not include_unlabelled: # drop unlabelled files
+        nii_gz_paths = [path_ for path_ in nii_gz_paths if '_4d.nii' not in path_]
+    return nii_gz_paths
+
+
+def construct_samples_list(root, include_unlabelled=False, nii_gz_paths=None):
     """
     E.g.
         file_id    slice_id  image_filename             label_filename
@@ -59,6 +75,7 @@ def construct_samples_list(root, include_unlabelled=False):
 
     Args:
         root (str): dataset root folder
+        nii_gz_paths (list of str): image volumes listed by list_acdc_volumes, the root folder is only scanned if None
 
     Returns:
         list of tuples (int, int, str, str): List of tuples, each with the following elements: file_id, slice_id, image_filename, label_filename
@@ -66,10 +83,8 @@ def construct_samples_list(root, include_unlabelled=False):
     samples = []
     img_cache = {}
     gt_cache = {}
-    nii_gz_paths = sorted(glob.glob(os.path.join(root,'**', '*.nii.gz'), recursive=True))
-    nii_gz_paths = [path_ for path_ in nii_gz_paths if '_gt.nii' not in path_ ]
-    if not include_unlabelled: # drop unlabelled files
-        nii_gz_paths = [path_ for path_ in nii_gz_paths if '_4d.nii' not in path_]
+    if nii_gz_paths is None:
+        nii_gz_paths = list_acdc_volumes(root, include_unlabelled)
     for file_id, nii_gz_path in tqdm(enumerate(nii_gz_paths), total=len(nii_gz_paths), desc="Constucting samples list from files"):
         img_data = load_acdc_img(nii_gz_path)
         num_slices = img_data.shape[2]
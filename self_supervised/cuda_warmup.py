@@ -0,0 +1,43 @@
+from typing import Iterable, Tuple
+
+import pytorch_lightning as pl
+import torch
+from pytorch_lightning.callbacks import Callback
+
+
+class CUDAWarmup(Callback):
+    def __init__(self, input_shapes: Iterable[Tuple[int, int, int, int]],
+                 memory_format: torch.memory_format = torch.channels_last):
+        """Pays the one-time costs of the first training step before training starts:
+        cuDNN algorithm search (when cudnn.benchmark is enabled) and the growth of the CUDA caching allocator.
+        Only the forward conv algorithms are warmed up, the eval/no-grad pass searches no backward algorithms.
+
+        Args:
+            input_shapes (Iterable[Tuple[int, int, int, int]]): (B, C, H, W) shapes of the crops fed to the backbone.
+                Not suited for a compiled backbone, the eval/no-grad dummy forward would trigger an extra compile.
+            memory_format (torch.memory_format, optional): memory format of the dummy inputs.
+                Defaults to torch.channels_last.
+        """
+        super().__init__()
+        self.input_shapes = input_shapes
+        self.memory_format = memory_format
+
+    def on_train_start(self, trainer: pl.Trainer, pl_module: pl.LightningModule):
+        """Runs a dummy forward pass of the backbone for every input shape.
+
+        Args:
+            trainer (pl.Trainer): pytorch lightning trainer object.
+            pl_module (pl.LightningModule): the pretrained solo method.
+        """
+        if pl_module.device.type != "cuda":
+            return
+
+        backbone = pl_module.backbone
+        was_training = backbone.training
+        # Batch norm running statistics are not updated by the dummy inputs in eval mode
+        backbone.eval()
+        with torch.no_grad(), trainer.precision_plugin.forward_context():
+            for shape in self.input_shapes:
+                backbone(torch.zeros(shape, device=pl_module.device).contiguous(memory_format=self.memory_format))
+        backbone.train(was_training)
+        torch.cuda.synchronize(pl_module.device)
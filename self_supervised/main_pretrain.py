@@ -17,15 +17,19 @@
 # OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import functools
 import inspect
 import os
+from typing import Optional
 
 import hydra
 import torch
 from omegaconf import DictConfig, OmegaConf
+from packaging.version import Version
 from pytorch_lightning import Trainer, seed_everything
 from pytorch_lightning.callbacks import LearningRateMonitor
 from pytorch_lightning.loggers import WandbLogger
+from pytorch_lightning.loops import FitLoop
 from pytorch_lightning.strategies.ddp import DDPStrategy
 
 from solo.args.pretrain import parse_cfg
@@ -34,43 +38,74 @@ from solo.data.pretrain_dataloader import (
     FullTransformPipeline,
     NCropAugmentation,
     build_transform_pipeline,
-    prepare_dataloader,
     prepare_datasets,
 )
 from solo.methods import METHODS, BaseMethod
 from solo.utils.auto_resumer import AutoResumer
 from solo.utils.checkpointer import Checkpointer
-from solo.utils.misc import make_contiguous
-
-try:
-    from solo.data.dali_dataloader import PretrainDALIDataModule, build_transform_pipeline_dali
-except ImportError:
-    _dali_avaliable = False
-else:
-    _dali_avaliable = True
-
-try:
-    from solo.utils.auto_umap import AutoUMAP
-except ImportError:
-    _umap_available = False
-else:
-    _umap_available = True
+from solo.utils.misc import omegaconf_select
 
 from termcolor import colored
 from solo.utils.momentum import initialize_momentum_params
 from solo.methods.base import BaseMomentumMethod
-from solo.data.pretrain_dataloader import dataset_with_index
 
 from self_supervised.weights_saver import WeightsSaver
+from self_supervised.cuda_warmup import CUDAWarmup
 from self_supervised.timm_encoder import timm_create_model_wrapper
+from self_supervised.pretrain_dataloader import prepare_pretrain_dataloader
 from models.pretrained_models import get_state_dict_form_pretrained_model_zoo
-from data.acdc_dataset import ACDCDatasetUnlabeleld
+from data.acdc_pretrain_dataloader import ACDCPretrainDataModule
 import utils
 
 
+class WorkaroundFitLoop(FitLoop):
+    """Fix for incompatibility with nvidia-dali and pytorch lightning with dali 1.15 (fixed on 1.16)
+    https://github.com/Lightning-AI/lightning/issues/12956
+    """
+
+    @property
+    def prefetch_batches(self) -> int:
+        return 1
+
+
+_TRAINER_KWARGS = frozenset(inspect.signature(Trainer.__init__).parameters)
+
+
+def make_dense(
+    module: torch.nn.Module,
+    memory_format: torch.memory_format = torch.contiguous_format,
+    dtype: Optional[torch.dtype] = None,
+):
+    """solo's make_contiguous and module.to(memory_format=..., dtype=...) in a single pass over the parameters.
+    4D parameters (conv weights) are converted to memory_format, the rest are made contiguous,
+    floating point parameters and buffers are cast to dtype (if given).
+    Parameters that are already in the requested layout and dtype are not copied.
+    """
+    with torch.no_grad():
+        for param in module.parameters():
+            param_format = memory_format if param.dim() == 4 else torch.contiguous_format
+            param_dtype = dtype if dtype is not None and param.is_floating_point() else param.dtype
+            param.data = param.data.contiguous(memory_format=param_format).to(param_dtype)
+        if dtype is not None:
+            for buffer in module.buffers():
+                if buffer.is_floating_point():
+                    buffer.data = buffer.data.to(dtype)
+
+
+@functools.lru_cache(maxsize=None)
+def cached_transform_pipeline(dataset: str, aug_cfg_yaml: str):
+    """build_transform_pipeline, but identical augmentation configs share a single transform object.
+    The (unhashable) augmentation config is passed as its resolved yaml dump, used as the cache key,
+    interpolations have to be resolved as the config is recreated without its parent.
+    """
+    return build_transform_pipeline(dataset, OmegaConf.create(aug_cfg_yaml))
+
+
 @hydra.main(version_base="1.2")
 def main(cfg: DictConfig):
     print("CUDA DEVICE COUNT:", torch.cuda.device_count())
+    # Remaining fp32 matmuls (outside of autocast) run on TF32 tensor cores
+    torch.backends.cuda.matmul.allow_tf32 = True
     # hydra doesn't allow us to add new keys for "safety"
     # set_struct(..., False) disables this behavior and allows us to add more parameters
     # without making the user specify every single thing about the model
@@ -78,9 +113,14 @@ def main(cfg: DictConfig):
     cfg = parse_cfg(cfg)
 
     # Substitute format string options in cfg.name
-    cfg.name = cfg.name.format(**utils.flatten_dict(cfg))
+    # A single walk over a plain dict, instead of accessing every DictConfig node
+    cfg.name = cfg.name.format(**utils.flatten_dict(OmegaConf.to_container(cfg, resolve=True)))
 
     seed_everything(cfg.seed)
+    # Input shapes are fixed (batch size x crops), let cuDNN pick the fastest conv algorithms.
+    # The RNGs are still seeded, but the selected algorithms (and the results) can differ between runs,
+    # set deterministic: True for bitwise reproducibility, Lightning disables benchmarking then
+    torch.backends.cudnn.benchmark = omegaconf_select(cfg, "performance.cudnn_benchmark", True)
 
     assert cfg.method in METHODS, f"Choose from {METHODS.keys()}"
 
@@ -106,19 +146,52 @@ def main(cfg: DictConfig):
         pretrained_weights = get_state_dict_form_pretrained_model_zoo(
             pretrain_cfg, in_chans=cfg.backbone.kwargs.get("in_chans", 3)
         )
+        # The model is still on the CPU here (Lightning moves it to the GPU in fit), so this is a host to host copy,
+        # release the loaded state dict right away instead of keeping a second copy of the weights during training
         model.backbone.load_state_dict(pretrained_weights)
+        del pretrained_weights
         print(colored(f"Encoder pretrained weights loaded from {pretrain_cfg}", "green"))
         if isinstance(model, BaseMomentumMethod):
             initialize_momentum_params(model.backbone, model.momentum_backbone)
             print(colored("Momentum backbone initialized from loaded weights", "green"))
     
-    make_contiguous(model)
-    # can provide up to ~20% speed up
-    if not cfg.performance.disable_channel_last:
-        model = model.to(memory_format=torch.channels_last)
+    # channels_last can provide up to ~20% speed up
+    memory_format = torch.contiguous_format if cfg.performance.disable_channel_last else torch.channels_last
+    # bf16 weights halve the memory of the model, but the optimizer updates them without an fp32 copy
+    bf16_weights = omegaconf_select(cfg, "performance.bf16_weights", False)
+    # The momentum update (tau * momentum + (1 - tau) * online) rounds to zero in bf16 as tau approaches 1,
+    # the target network would stop moving
+    assert not (
+        bf16_weights and isinstance(model, BaseMomentumMethod)
+    ), "performance.bf16_weights is not supported for momentum methods (e.g. BYOL)"
+    assert not bf16_weights or (
+        torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+    ), "performance.bf16_weights requires a GPU with bf16 support"
+    make_dense(model, memory_format, dtype=torch.bfloat16 if bf16_weights else None)
+
+    if omegaconf_select(cfg, "performance.compile", False):
+        assert hasattr(torch, "compile"), "performance.compile requires torch>=2.0"
+        # Compiling the forward methods only keeps the state dict keys (and the saved weights) unchanged,
+        # batch sizes and crop sizes are fixed, so there is no need for dynamic shapes
+        for name in ["backbone", "projector"]:
+            if hasattr(model, name):
+                submodule = getattr(model, name)
+                submodule.forward = torch.compile(submodule.forward, mode="max-autotune", dynamic=False)
 
     # validation dataloader for when it is available
-    if cfg.data.dataset == "custom" and (cfg.data.no_labels or cfg.data.val_path is None):
+    # max_epochs can also be -1 (infinite training) or None (limited by max_steps),
+    # check_val_every_n_epoch can be None (validation scheduled by val_check_interval only)
+    max_epochs = omegaconf_select(cfg, "max_epochs", None)
+    check_val_every_n_epoch = omegaconf_select(cfg, "check_val_every_n_epoch", 1)
+    if (
+        isinstance(max_epochs, int)
+        and max_epochs > 0
+        and isinstance(check_val_every_n_epoch, int)
+        and check_val_every_n_epoch > max_epochs
+    ):
+        # validation would never run
+        val_loader = None
+    elif cfg.data.dataset == "custom" and (cfg.data.no_labels or cfg.data.val_path is None):
         val_loader = None
     elif cfg.data.dataset in ["imagenet100", "imagenet"] and cfg.data.val_path is None:
         val_loader = None
@@ -134,11 +207,87 @@ def main(cfg: DictConfig):
             val_data_path=cfg.data.val_path,
             data_format=val_data_format,
             batch_size=cfg.optimizer.batch_size,
-            num_workers=cfg.data.num_workers,
+            # validation runs infrequently, a few workers are enough
+            num_workers=min(2, cfg.data.num_workers),
         )
 
+    # ACDC volumes are decoded once on the CPU, augmentations are offloaded to DALI (on the GPU by default)
+    # DALI and UMAP are only imported when they are used, importing DALI loads a large shared library
+    use_acdc_dali = cfg.data.custom_dataset_name == "acdc" and omegaconf_select(cfg, "dali.enabled", False)
+    if use_acdc_dali:
+        # blur, solarization and equalization are not implemented by the ACDC DALI pipeline
+        unsupported = [
+            name
+            for name in ["gaussian_blur", "solarization", "equalization"]
+            if any(aug_cfg[name].prob > 0 for aug_cfg in cfg.augmentations)
+        ]
+        if unsupported:
+            print(
+                colored(
+                    f"{', '.join(unsupported)} not supported by the ACDC DALI pipeline, "
+                    "falling back to the PyTorch ACDC dataloader.",
+                    "yellow",
+                )
+            )
+            use_acdc_dali = False
+    if use_acdc_dali:
+        try:
+            import nvidia.dali
+        except ImportError:
+            print(colored("Dali is not available, falling back to the PyTorch ACDC dataloader.", "yellow"))
+            use_acdc_dali = False
+    if use_acdc_dali:
+        # Imported outside of the guard, errors of the repo module should not be reported as a missing DALI
+        from data.acdc_dali_dataloader import ACDCPretrainDALIDataModule
+        from data.acdc_dali_dataloader import build_transform_pipeline_dali as build_acdc_transform_pipeline_dali
+
+    # Without DALI, ACDC augmentations can be executed on the GPU with kornia, CPU workers only resize the slices
+    use_acdc_kornia = (
+        not use_acdc_dali
+        and cfg.data.custom_dataset_name == "acdc"
+        and omegaconf_select(cfg, "data.gpu_augmentations", False)
+    )
+    if use_acdc_kornia:
+        try:
+            from data.acdc_kornia_augmentations import (
+                GPUTransformPipeline,
+                ResizeToTensor,
+                build_transform_pipeline_kornia,
+            )
+        except ImportError:
+            print(colored("Kornia is not available, falling back to CPU augmentations.", "yellow"))
+            use_acdc_kornia = False
+
     # pretrain dataloader
-    if cfg.data.format == "dali":
+    if use_acdc_dali:
+        pipelines = []
+        for aug_cfg in cfg.augmentations:
+            pipelines.append(
+                NCropAugmentation(
+                    build_acdc_transform_pipeline_dali(aug_cfg),
+                    aug_cfg.num_crops,
+                )
+            )
+        transform = FullTransformPipeline(pipelines)
+
+        datamodule = ACDCPretrainDALIDataModule(
+            train_data_path=os.path.expanduser(cfg.data.train_path),
+            transforms=transform,
+            num_crops=sum(aug_cfg.num_crops for aug_cfg in cfg.augmentations),
+            num_workers=cfg.data.num_workers,
+            batch_size=cfg.optimizer.batch_size,
+            dali_device=cfg.dali.device,
+            seed=cfg.seed,
+        )
+        datamodule.val_dataloader = lambda: val_loader
+    elif cfg.data.format == "dali":
+        try:
+            import nvidia.dali
+            from solo.data.dali_dataloader import PretrainDALIDataModule, build_transform_pipeline_dali
+        except ImportError:
+            _dali_avaliable = False
+        else:
+            _dali_avaliable = True
         assert (
             _dali_avaliable
         ), "Dali is not currently avaiable, please install it first with pip3 install .[dali]."
@@ -154,7 +303,7 @@ def main(cfg: DictConfig):
             )
         transform = FullTransformPipeline(pipelines)
 
-        dali_datamodule = PretrainDALIDataModule(
+        datamodule = PretrainDALIDataModule(
             dataset=cfg.data.dataset,
             train_data_path=cfg.data.train_path,
             transforms=transform,
@@ -167,13 +316,30 @@ def main(cfg: DictConfig):
             dali_device=cfg.dali.device,
             encode_indexes_into_labels=cfg.dali.encode_indexes_into_labels,
         )
-        dali_datamodule.val_dataloader = lambda: val_loader
+        datamodule.val_dataloader = lambda: val_loader
+    elif use_acdc_kornia:
+        gpu_transform = GPUTransformPipeline(
+            [(build_transform_pipeline_kornia(aug_cfg), aug_cfg.num_crops) for aug_cfg in cfg.augmentations]
+        )
+
+        if cfg.debug_augmentations:
+            print("Transforms:")
+            print(gpu_transform)
+        datamodule = ACDCPretrainDataModule(
+            train_data_path=os.path.expanduser(cfg.data.train_path),
+            transform=ResizeToTensor(max(aug_cfg.crop_size for aug_cfg in cfg.augmentations)),
+            batch_size=cfg.optimizer.batch_size,
+            num_workers=cfg.data.num_workers,
+            gpu_transform=gpu_transform,
+        )
+        datamodule.val_dataloader = lambda: val_loader
     else:
         pipelines = []
         for aug_cfg in cfg.augmentations:
             pipelines.append(
                 NCropAugmentation(
-                    build_transform_pipeline(cfg.data.dataset, aug_cfg), aug_cfg.num_crops
+                    cached_transform_pipeline(cfg.data.dataset, OmegaConf.to_yaml(aug_cfg, resolve=True)),
+                    aug_cfg.num_crops,
                 )
             )
         transform = FullTransformPipeline(pipelines)
@@ -182,10 +348,16 @@ def main(cfg: DictConfig):
             print("Transforms:")
             print(transform)
         if cfg.data.custom_dataset_name == "acdc":
-            train_dataset = dataset_with_index(ACDCDatasetUnlabeleld)(
-                root=os.path.expanduser(cfg.data.train_path), transform=transform
+            # the dataset is built in setup, after the processes are initialized
+            datamodule = ACDCPretrainDataModule(
+                train_data_path=os.path.expanduser(cfg.data.train_path),
+                transform=transform,
+                batch_size=cfg.optimizer.batch_size,
+                num_workers=cfg.data.num_workers,
             )
+            datamodule.val_dataloader = lambda: val_loader
         else:
+            datamodule = None
             train_dataset = prepare_datasets(
                 cfg.data.dataset,
                 transform,
@@ -194,9 +366,9 @@ def main(cfg: DictConfig):
                 no_labels=cfg.data.no_labels,
                 data_fraction=cfg.data.fraction,
             )
-        train_loader = prepare_dataloader(
-            train_dataset, batch_size=cfg.optimizer.batch_size, num_workers=cfg.data.num_workers
-        )
+            train_loader = prepare_pretrain_dataloader(
+                train_dataset, batch_size=cfg.optimizer.batch_size, num_workers=cfg.data.num_workers
+            )
 
     # 1.7 will deprecate resume_from_checkpoint, but for the moment
     # the argument is the same, but we need to pass it as ckpt_path to trainer.fit
@@ -217,6 +389,9 @@ def main(cfg: DictConfig):
         ckpt_path = cfg.resume_from_checkpoint
         del cfg.resume_from_checkpoint
 
+    # cfg is not modified below, convert it once for the hyperparameter logging and the Trainer kwargs
+    cfg_container = OmegaConf.to_container(cfg, resolve=True)
+
     callbacks = []
 
     if cfg.checkpoint.enabled:
@@ -230,6 +405,12 @@ def main(cfg: DictConfig):
         callbacks.append(ckpt)
 
     if cfg.auto_umap.enabled:
+        try:
+            from solo.utils.auto_umap import AutoUMAP
+        except ImportError:
+            _umap_available = False
+        else:
+            _umap_available = True
         assert (
             _umap_available
         ), "UMAP is not currently avaiable, please install it first with [umap]."
@@ -250,8 +431,10 @@ def main(cfg: DictConfig):
             resume="allow" if wandb_run_id else None,
             id=wandb_run_id,
         )
-        wandb_logger.watch(model, log="gradients", log_freq=100)
-        wandb_logger.log_hyperparams(OmegaConf.to_container(cfg))
+        # gradient histograms add hooks to every parameter, only log them on request
+        if omegaconf_select(cfg, "wandb.watch_gradients", False):
+            wandb_logger.watch(model, log="gradients", log_freq=omegaconf_select(cfg, "wandb.watch_freq", 1000))
+        wandb_logger.log_hyperparams(cfg_container)
 
         # lr logging
         lr_monitor = LearningRateMonitor(logging_interval="step")
@@ -261,41 +444,59 @@ def main(cfg: DictConfig):
         weights_saver = WeightsSaver(model, [5, 10, 50, 100, 200, 300, 400])
         callbacks.append(weights_saver)
 
-    trainer_kwargs = OmegaConf.to_container(cfg)
+    # A compiled backbone would be traced for eval/no-grad by the dummy forward and compiled
+    # again for training, doubling the compile time
+    if omegaconf_select(cfg, "performance.warmup", True) and not omegaconf_select(cfg, "performance.compile", False):
+        in_chans = cfg.backbone.kwargs.get("in_chans", 3)
+        input_shapes = {
+            (cfg.optimizer.batch_size, in_chans, aug_cfg.crop_size, aug_cfg.crop_size)
+            for aug_cfg in cfg.augmentations
+        }
+        callbacks.append(CUDAWarmup(input_shapes, memory_format))
+
+    # gradients are views into the all-reduce buckets, saving a gradient sized copy every step
+    ddp_kwargs = {"find_unused_parameters": False, "gradient_as_bucket_view": True}
+    if omegaconf_select(cfg, "performance.ddp_static_graph", False):
+        # Only valid if every step uses the same parameters (true for most solo methods), requires torch>=1.11
+        ddp_kwargs["static_graph"] = True
+
     # we only want to pass in valid Trainer args, the rest may be user specific
-    valid_kwargs = inspect.signature(Trainer.__init__).parameters
-    trainer_kwargs = {name: trainer_kwargs[name] for name in valid_kwargs if name in trainer_kwargs}
+    trainer_kwargs = {name: cfg_container[name] for name in _TRAINER_KWARGS if name in cfg_container}
     trainer_kwargs.update(
         {
             "logger": wandb_logger if cfg.wandb.enabled else None,
             "callbacks": callbacks,
             "enable_checkpointing": False,
-            "strategy": DDPStrategy(find_unused_parameters=False)
+            "strategy": DDPStrategy(**ddp_kwargs)
             if cfg.strategy == "ddp"
             else cfg.strategy,
         }
     )
+    # bf16 autocast needs no loss scaling, it's combined with channels_last by default (performance.disable_channel_last)
+    # Pre-Ampere GPUs don't support bf16, fall back to fp16 on them
+    trainer_kwargs["precision"] = omegaconf_select(
+        cfg, "performance.precision", trainer_kwargs.get("precision", "bf16")
+    )
+    if trainer_kwargs["precision"] == "bf16" and not (
+        torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+    ):
+        trainer_kwargs["precision"] = 16
+    if bf16_weights:
+        # autocast has to match the dtype of the weights, bf16 support is checked when the weights are cast
+        trainer_kwargs["precision"] = "bf16"
     trainer = Trainer(**trainer_kwargs)
 
-    # fix for incompatibility with nvidia-dali and pytorch lightning
-    # with dali 1.15 (this will be fixed on 1.16)
-    # https://github.com/Lightning-AI/lightning/issues/12956
-    try:
-        from pytorch_lightning.loops import FitLoop
-
-        class WorkaroundFitLoop(FitLoop):
-            @property
-            def prefetch_batches(self) -> int:
-                return 1
-
-        trainer.fit_loop = WorkaroundFitLoop(
-            trainer.fit_loop.min_epochs, trainer.fit_loop.max_epochs
-        )
-    except:
-        pass
+    use_dali = cfg.data.format == "dali" or use_acdc_dali
+    if use_dali and Version(nvidia.dali.__version__) < Version("1.16"):
+        try:
+            trainer.fit_loop = WorkaroundFitLoop(
+                trainer.fit_loop.min_epochs, trainer.fit_loop.max_epochs
+            )
+        except Exception as e:
+            print(colored(f"Unable to apply the DALI workaround fit loop: {e}", "yellow"))
 
-    if cfg.data.format == "dali":
-        trainer.fit(model, ckpt_path=ckpt_path, datamodule=dali_datamodule)
+    if datamodule is not None:
+        trainer.fit(model, ckpt_path=ckpt_path, datamodule=datamodule)
     else:
         trainer.fit(model, train_loader, val_loader, ckpt_path=ckpt_path)
 
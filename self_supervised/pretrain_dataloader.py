@@ -0,0 +1,26 @@
+from torch.utils.data import DataLoader, Dataset
+
+
+def prepare_pretrain_dataloader(dataset: Dataset, batch_size: int = 64, num_workers: int = 4) -> DataLoader:
+    """Same as solo-learn's prepare_dataloader, but workers are kept alive between epochs.
+
+    Args:
+        dataset (Dataset): the pretraining dataset.
+        batch_size (int, optional): batch size. Defaults to 64.
+        num_workers (int, optional): number of dataloader workers. Defaults to 4.
+
+    Returns:
+        DataLoader: the training dataloader.
+    """
+    # Higher prefetch factors don't increase throughput, only the host memory usage.
+    # prefetch_factor is only accepted with workers (torch>=2.0 rejects it otherwise)
+    worker_kwargs = {"persistent_workers": True, "prefetch_factor": 2} if num_workers > 0 else {}
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=True,
+        num_workers=num_workers,
+        pin_memory=True,
+        drop_last=True,
+        **worker_kwargs,
+    )
@@ -54,8 +54,8 @@ class WeightsSaver(Callback):
         Args:
             trainer (pl.Trainer): pytorch lightning trainer object.
         """
-        state_dict = self.model_to_save.state_dict()
         if trainer.is_global_zero:
+            state_dict = self.model_to_save.state_dict()
             if trainer.sanity_checking:
                 filepath = os.path.join(self.path, "sanity_checking_weights_saving.pth")
                 torch.save(state_dict, filepath)
@@ -3,15 +3,26 @@ import glob
 import shutil
 from tqdm import tqdm
 import pydoc
+from collections import deque
 import omegaconf
 
 def flatten_dict(d, top_level_key="", sep="_"):
+    """Flattens nested dicts (or DictConfigs), nested keys are prefixed by their parent's key only.
+    E.g. {"a": {"b": {"c": 1}}, "d": 2} -> {"b_c": 1, "d": 2}
+    Iterative (depth first, in the order of the items), pass a resolved plain dict
+    (OmegaConf.to_container(cfg, resolve=True)) to avoid accessing every node of a DictConfig.
+    """
     flat_d = {}
-    for k, v in d.items():
-        if isinstance(v, (dict, omegaconf.DictConfig)):
-            flat_d.update(flatten_dict (v, top_level_key=(k + sep)))
+    stack = deque([(top_level_key, iter(d.items()))])
+    while stack:
+        prefix, items = stack[-1]
+        for k, v in items:
+            if isinstance(v, (dict, omegaconf.DictConfig)):
+                stack.append((k + sep, iter(v.items())))
+                break
+            flat_d[prefix + k] = v
         else:
-            flat_d[top_level_key + k] = v
+            stack.pop()
     return flat_d
 
 def object_from_dict(d, parent=None, **default_kwargs):